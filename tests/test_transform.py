@@ -1,4 +1,5 @@
 import ast
+import warnings
 import numpy as np
 from os import system
 import unittest
@@ -11,6 +12,8 @@ import pandas as pd
 from sklearn.cross_validation import KFold as SKKFold
 
 from upsg.pipeline import Pipeline
+from upsg.stage import RunnableStage
+from upsg.uobject import UObject, UObjectPhase
 from upsg.export.csv import CSVWrite
 from upsg.export.np import NumpyWrite
 from upsg.fetch.csv import CSVRead
@@ -26,6 +29,7 @@ from upsg.transform.identity import Identity
 from upsg.transform.apply_to_selected_cols import ApplyToSelectedCols
 from upsg.transform.merge import Merge
 from upsg.transform.hstack import HStack
+from upsg.transform.jit import ApplyKernel, jit_kernel, numba
 from upsg.transform.generate_feature import GenerateFeature
 from upsg.wrap.wrap_sklearn import wrap
 from upsg.utils import np_nd_to_sa, np_sa_to_nd, is_sa, obj_to_str
@@ -136,6 +140,39 @@ class TestTransform(UPSGTestCase):
 
         self.assertTrue(np.array_equal(result, ctrl))
 
+    def test_split_columns_all_selected(self):
+        in_data = np_nd_to_sa(np.random.rand(10, 3))
+
+        p = Pipeline()
+
+        node_in = p.add(NumpyRead(in_data))
+        split = p.add(SplitColumns(in_data.dtype.names))
+        node_in['output'] > split['input']
+        node_sel = p.add(NumpyWrite())
+        split['output'] > node_sel['input']
+        node_rest = p.add(NumpyWrite())
+        split['complement'] > node_rest['input']
+
+        self.run_pipeline(p)
+
+        self.assertTrue(np.array_equal(node_sel.get_stage().result, in_data))
+        rest = node_rest.get_stage().result
+        self.assertEqual(len(rest), len(in_data))
+        self.assertEqual(len(rest.dtype), 0)
+
+        # Other run modes pass tables between Stages as images
+        uo_in = UObject(UObjectPhase.Write)
+        uo_in.from_np(in_data)
+        uo_in.write_to_read_phase()
+        uo_rest = SplitColumns(in_data.dtype.names).run(
+            ['output', 'complement'], 
+            input=uo_in)['complement']
+        uo_read = UObject(UObjectPhase.Read, uo_rest.get_image())
+        self.assertEqual(uo_read.to_soa().n_rows, len(in_data))
+        rest = uo_read.to_np()
+        self.assertEqual(len(rest), len(in_data))
+        self.assertEqual(len(rest.dtype), 0)
+
     def __test_ast_trans(self, raw, target, col_names):    
         # There doesn't seem to be a better easy way to test AST equality
         # than seeing if their dumps are equal:
@@ -507,6 +544,200 @@ class TestTransform(UPSGTestCase):
                         np.nan_to_num(result[col]), 
                         np.nan_to_num(in_data[col])))
 
+    def test_apply_to_selected_cols_kernel(self):
+        class Double(RunnableStage):
+            @property
+            def input_keys(self):
+                return ['input']
+
+            @property
+            def output_keys(self):
+                return ['output']
+
+            @staticmethod
+            def kernel(A):
+                return A * 2.0
+
+            def run(self, outputs_requested, **kwargs):
+                raise AssertionError('kernel should have been used')
+
+        in_data = np_nd_to_sa(np.random.rand(100, 5))
+        sel_cols = ['f1', 'f3']
+
+        p = Pipeline()
+
+        node_in = p.add(NumpyRead(in_data))
+        node_selected = p.add(ApplyToSelectedCols(sel_cols, Double))
+        node_in['output'] > node_selected['input']
+        node_out = p.add(NumpyWrite())
+        node_selected['output'] > node_out['input']
+
+        self.run_pipeline(p)
+
+        result = node_out.get_stage().result
+        for col in in_data.dtype.names:
+            if col in sel_cols:
+                self.assertTrue(np.allclose(result[col], in_data[col] * 2))
+            else:
+                self.assertTrue(np.array_equal(result[col], in_data[col]))
+
+    def test_apply_to_selected_cols_fused(self):
+        class Center(RunnableStage):
+            @property
+            def input_keys(self):
+                return ['X_train']
+
+            @property
+            def output_keys(self):
+                return ['X_new']
+
+            def run(self, outputs_requested, **kwargs):
+                A = kwargs['X_train'].to_np()
+                for col in A.dtype.names:
+                    A[col] -= A[col].mean()
+                uo_out = UObject(UObjectPhase.Write)
+                uo_out.from_np(A)
+                return {'X_new': uo_out}
+
+        in_data = np_nd_to_sa(np.random.rand(100, 5))
+        sel_cols = ['f1', 'f3']
+
+        p = Pipeline()
+
+        node_in = p.add(NumpyRead(in_data))
+        node_selected = p.add(ApplyToSelectedCols(sel_cols, Center))
+        node_in['output'] > node_selected['X_train']
+        node_out = p.add(NumpyWrite())
+        node_selected['X_new'] > node_out['input']
+
+        self.run_pipeline(p)
+
+        result = node_out.get_stage().result
+        self.assertEqual(set(result.dtype.names), set(in_data.dtype.names))
+        for col in in_data.dtype.names:
+            if col in sel_cols:
+                self.assertTrue(np.allclose(
+                    result[col], 
+                    in_data[col] - in_data[col].mean()))
+            else:
+                self.assertTrue(np.array_equal(result[col], in_data[col]))
+
+    def test_apply_to_selected_cols_different_rows(self):
+        class Head(RunnableStage):
+            @property
+            def input_keys(self):
+                return ['input']
+
+            @property
+            def output_keys(self):
+                return ['output']
+
+            def run(self, outputs_requested, **kwargs):
+                uo_out = UObject(UObjectPhase.Write)
+                uo_out.from_np(kwargs['input'].to_np()[:5])
+                return {'output': uo_out}
+
+        in_data = np_nd_to_sa(np.random.rand(10, 3))
+        sel_cols = ['f1']
+
+        p = Pipeline()
+
+        node_in = p.add(NumpyRead(in_data))
+        node_selected = p.add(ApplyToSelectedCols(sel_cols, Head))
+        node_in['output'] > node_selected['input']
+        node_out = p.add(NumpyWrite())
+        node_selected['output'] > node_out['input']
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.run_pipeline(p)
+        self.assertTrue(any(issubclass(w.category, UserWarning) for 
+                            w in caught))
+
+        result = node_out.get_stage().result
+        self.assertEqual(len(result), len(in_data))
+        self.assertTrue(np.array_equal(result['f1'][:5], in_data['f1'][:5]))
+        for col in ('f0', 'f2'):
+            self.assertTrue(np.array_equal(result[col], in_data[col]))
+
+    def test_apply_to_selected_cols_kernel_not_callable(self):
+        class Negate(RunnableStage):
+            # e.g. the name of an sklearn kernel, not a kernel we can apply
+            kernel = 'rbf'
+
+            @property
+            def input_keys(self):
+                return ['input']
+
+            @property
+            def output_keys(self):
+                return ['output']
+
+            def run(self, outputs_requested, **kwargs):
+                A = kwargs['input'].to_np()
+                for col in A.dtype.names:
+                    A[col] = -A[col]
+                uo_out = UObject(UObjectPhase.Write)
+                uo_out.from_np(A)
+                return {'output': uo_out}
+
+        in_data = np_nd_to_sa(np.random.rand(10, 3))
+        sel_cols = ['f1']
+
+        p = Pipeline()
+
+        node_in = p.add(NumpyRead(in_data))
+        node_selected = p.add(ApplyToSelectedCols(sel_cols, Negate))
+        node_in['output'] > node_selected['input']
+        node_out = p.add(NumpyWrite())
+        node_selected['output'] > node_out['input']
+
+        self.run_pipeline(p)
+
+        result = node_out.get_stage().result
+        self.assertTrue(np.array_equal(result['f1'], -in_data['f1']))
+        self.assertRaises(TypeError, jit_kernel, 'rbf')
+
+    def test_apply_kernel(self):
+        def double(A):
+            return A * 2.0
+
+        for rows in (100, 0):
+            in_data = np_nd_to_sa(np.random.rand(rows, 5))
+
+            p = Pipeline()
+
+            node_in = p.add(NumpyRead(in_data))
+            node_kernel = p.add(ApplyKernel(double))
+            node_in['output'] > node_kernel['input']
+            node_out = p.add(NumpyWrite())
+            node_kernel['output'] > node_out['input']
+
+            self.run_pipeline(p)
+
+            result = node_out.get_stage().result
+            self.assertEqual(result.dtype, in_data.dtype)
+            self.assertEqual(len(result), rows)
+            for col in in_data.dtype.names:
+                self.assertTrue(np.allclose(result[col], in_data[col] * 2))
+
+        class Doubler(object):
+            def kernel(self, A):
+                return A * 2.0
+
+        # numba can't compile bound methods
+        self.assertRaises(TypeError, ApplyKernel, Doubler().kernel)
+
+    @unittest.skipIf(numba is None, 'numba is not installed')
+    def test_jit_kernel_numba(self):
+        # numba can't cache a kernel without a source file
+        namespace = {}
+        exec('def double(A):\n    return A * 2.0\n', namespace)
+        kernel = jit_kernel(namespace['double'])
+        self.assertTrue(hasattr(kernel, 'py_func'))
+        A = np.random.rand(10, 3)
+        self.assertTrue(np.allclose(kernel(A), A * 2.0))
+
     def test_merge(self):
         a1 = np.array([(0, 'Lisa', 2),
                        (1, 'Bill', 1),
@@ -596,6 +827,51 @@ class TestTransform(UPSGTestCase):
 
         self.assertTrue(np.array_equal(ctrl, out.get_stage().result))
 
+    def test_hstack_no_rows(self):
+        homogeneous = (np.array([], dtype=[('f0', float), ('f1', float)]),
+                       np.array([], dtype=[('f2', float), ('f3', float)]))
+        heterogeneous = (np.array([], dtype=[('f0', int), ('f1', 'S3')]),
+                         np.array([], dtype=[('f2', float)]))
+        for a, b in (homogeneous, heterogeneous):
+            p = Pipeline()
+
+            np_in_a = p.add(NumpyRead(a))
+            np_in_b = p.add(NumpyRead(b))
+            hstack = p.add(HStack(2))
+            hstack(np_in_a, np_in_b)
+            out = p.add(NumpyWrite())
+            out(hstack)
+
+            p.run()
+
+            result = out.get_stage().result
+            self.assertEqual(len(result), 0)
+            self.assertEqual(result.dtype.names, 
+                             a.dtype.names + b.dtype.names)
+
+    def test_hstack_no_columns(self):
+        a = np_nd_to_sa(np.random.rand(3, 2))
+
+        p = Pipeline()
+
+        np_in = p.add(NumpyRead(a))
+        # complements of selecting every column have no columns
+        split_a = p.add(SplitColumns(a.dtype.names))
+        np_in['output'] > split_a['input']
+        split_b = p.add(SplitColumns(a.dtype.names))
+        np_in['output'] > split_b['input']
+        hstack = p.add(HStack(2))
+        split_a['complement'] > hstack['input0']
+        split_b['complement'] > hstack['input1']
+        out = p.add(NumpyWrite())
+        out(hstack)
+
+        p.run()
+
+        result = out.get_stage().result
+        self.assertEqual(len(result), 3)
+        self.assertEqual(len(result.dtype), 0)
+
     def test_generate_feature(self):
         in_array = np.array(
                 [(0.0, 0.1, 0.2, 0.3), (1.0, 1.1, 1.2, 1.3), 
@@ -52,6 +52,74 @@ class TestUObject(UPSGTestCase):
         d = uo.to_dict()
         self.assertEqual(d, self.test_dict)
 
+    def test_np_image(self):
+        uo = UObject(UObjectPhase.Write)
+        uo.from_np(self.test_array)
+        uo_read = UObject(UObjectPhase.Read, uo.get_image())
+        A = uo_read.to_np()
+        self.assertTrue(np.array_equal(self.test_array, A))
+        self.assertEqual(self.test_array.dtype, A.dtype)
+
+    def test_soa(self):
+        uo = UObject(UObjectPhase.Write)
+        uo.from_np(self.test_array)
+        uo.write_to_read_phase()
+        soa = uo.to_soa()
+        self.assertEqual(list(soa.keys()), list(self.test_array.dtype.names))
+        uo_out = UObject(UObjectPhase.Write)
+        uo_out.from_soa(soa)
+        uo_out.write_to_read_phase()
+        A = uo_out.to_np()
+        self.assertTrue(np.array_equal(self.test_array, A))
+        self.assertEqual(self.test_array.dtype, A.dtype)
+
+    def test_np_unstorable_types(self):
+        for dtype in ([('id', int), ('obj', object)], 
+                      [('id', int), ('name', 'U10')],
+                      [('id', int), ('elapsed', 'm8[s]')],
+                      []):
+            uo = UObject(UObjectPhase.Write)
+            A = np.zeros(3, dtype=dtype)
+            self.assertRaises(UObjectException, uo.from_np, A)
+
+    def test_csv_matches_savetxt(self):
+        dtype = [('id', int), ('score', float), ('flag', bool), 
+                 ('name', 'S16')]
+        plain = np.array([(0, 1.5, True, 'Lisa'), 
+                          (1, np.nan, False, 'Bill'),
+                          (2, -2.25, True, 'Fred')], dtype=dtype)
+        # entries pandas would quote
+        quoted = np.array([(0, 1.5, True, 'Smith, Lisa'), 
+                           (1, np.nan, False, 'Bill "Bo"'),
+                           (2, -2.25, True, 'Fred')], dtype=dtype)
+        # a column that holds arrays
+        subarray = np.array([((1.0, 2.0), 3), ((4.0, 5.0), 6)], 
+                            dtype=[('x', float, 2), ('i', int)])
+        for table in (plain, quoted, subarray):
+            uo = UObject(UObjectPhase.Write)
+            uo.from_np(table)
+            uo.write_to_read_phase()
+            result_file = uo.to_csv(self._tmp_files('result.csv'))
+            ctrl_file = self._tmp_files('ctrl.csv')
+            header = ','.join('"{}"'.format(name) for name in 
+                              table.dtype.names)
+            np.savetxt(ctrl_file, table, delimiter=',', fmt='%s', 
+                       header=header)
+            with open(result_file) as result, open(ctrl_file) as ctrl:
+                self.assertEqual(result.read(), ctrl.read())
+
+    def test_soa_copy(self):
+        uo = UObject(UObjectPhase.Write)
+        uo.from_np(self.test_array)
+        uo.write_to_read_phase()
+        for name in self.test_array.dtype.names:
+            self.assertFalse(np.may_share_memory(
+                uo.to_soa()[name], 
+                self.test_array))
+            self.assertTrue(np.may_share_memory(
+                uo.to_soa(copy=False)[name], 
+                self.test_array))
+
     def test_sql(self):
         # Make sure we don't accidentally corrupt our test database
         db_path, db_file_name = self._tmp_files.tmp_copy(path_of_data(
@@ -1,8 +1,10 @@
 import numpy as np
 from os import system
 import unittest
-from utils import UPSGTestCase
+from collections import OrderedDict
+from utils import UPSGTestCase, path_of_data
 
+import upsg.utils
 from upsg.utils import *
 
 
@@ -37,6 +39,16 @@ class TestUtils(UPSGTestCase):
         self.assertEqual(control.dtype, result.dtype)
         self.assertTrue(np.array_equal(result, control))
 
+    def test_nd_sa_round_trip_no_copy(self):
+        # Homogeneous tables should go between nd and sa representations
+        # without copying the data
+        nd = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]], dtype=float)
+        sa = np_nd_to_sa(nd)
+        self.assertTrue(np.may_share_memory(nd, sa))
+        (result, sa_dtype) = np_sa_to_nd(sa)
+        self.assertTrue(np.may_share_memory(nd, result))
+        self.assertTrue(np.array_equal(result, nd))
+
     def test_is_sa(self):
         nd = np.array([[1, 2, 3], [4, 5, 6]], dtype=int)
         dtype = np.dtype({'names': map('f{}'.format, xrange(3)),
@@ -50,5 +62,66 @@ class TestUtils(UPSGTestCase):
         self.assertEqual(np.dtype(np_type(7.2)), np.dtype(float))
         self.assertEqual(np.dtype(np_type("hello")), np.dtype("S5"))
 
+    def test_soa_to_np_sa_no_columns(self):
+        self.assertRaises(ValueError, soa_to_np_sa, {})
+        sa = soa_to_np_sa({}, 4)
+        self.assertEqual(len(sa), 4)
+        self.assertEqual(len(sa.dtype), 0)
+
+    def test_soa_to_np_sa_parallel(self):
+        # Force the threaded fill, even for a small table on a machine with
+        # one core
+        min_bytes = upsg.utils.PARALLEL_FILL_MIN_BYTES
+        cpu_count = upsg.utils.cpu_count
+        upsg.utils.PARALLEL_FILL_MIN_BYTES = 0
+        upsg.utils.cpu_count = lambda: 4
+        try:
+            rows = 101
+            soa = OrderedDict((('id', np.arange(rows)), 
+                               ('val', np.random.rand(rows)),
+                               ('name', np.array(
+                                   ['row{}'.format(i) for i in xrange(rows)]))))
+            result = soa_to_np_sa(soa)
+        finally:
+            upsg.utils.PARALLEL_FILL_MIN_BYTES = min_bytes
+            upsg.utils.cpu_count = cpu_count
+        self.assertEqual(result.dtype.names, tuple(soa.keys()))
+        for col_name in soa:
+            self.assertTrue(np.array_equal(result[col_name], soa[col_name]))
+
+    def test_hstack_soas(self):
+        left = OrderedDict((('a', np.arange(3)), ('b', np.arange(3.0))))
+        right = OrderedDict((('c', np.array(['x', 'y', 'z'])),))
+        result = hstack_soas([left, right])
+        self.assertEqual(result.dtype.names, ('a', 'b', 'c'))
+        for soa in (left, right):
+            for col_name in soa:
+                self.assertTrue(np.array_equal(result[col_name], 
+                                               soa[col_name]))
+        self.assertRaises(ValueError, hstack_soas, [left, left])
+
+    def test_csv_to_np_sa(self):
+        for csv_name in ('mixed_csv.csv', 'with_dates.csv', 'categories.csv',
+                         'numbers.csv', 'test_toaster.csv'):
+            filename = path_of_data(csv_name)
+            result = csv_to_np_sa(filename)
+            ctrl = np.genfromtxt(filename, dtype=None, delimiter=',', 
+                                 names=True)
+            self.assertEqual(result.dtype, ctrl.dtype)
+            self.assertTrue(np.array_equal(result, ctrl))
+
+    def test_csv_to_np_sa_fallback(self):
+        # Cases genfromtxt reads differently should be left to genfromtxt
+        self.assertIsNone(csv_to_np_sa(path_of_data('missing_vals.csv')))
+        for tmp_name, contents in (
+                ('commented_header.csv', '# a,b\n1,2\n3,4\n'),
+                ('bad_names.csv', 'a b,c-d\n1,2\n3,4\n'),
+                ('big_ints.csv', 'a,b\n1,99999999999999999999\n3,4\n'),
+                ('trailing_space.csv', 'a,b\n1,x\n3,y \n')):
+            filename = self._tmp_files(tmp_name)
+            with open(filename, 'w') as fout:
+                fout.write(contents)
+            self.assertIsNone(csv_to_np_sa(filename))
+
 if __name__ == '__main__':
     unittest.main()
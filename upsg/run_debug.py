@@ -409,34 +409,40 @@ def run(pipeline, nodes, output='', report_path='', single_step=False):
     node_queue = [node for node in nodes
                   if not node.get_outputs()]  # start with the root nodes
     state = dict.fromkeys(nodes, None)
-    while node_queue:
-        node = node_queue.pop()
-        if state[node] is not None:  # already computed
-            continue
-        input_connections = node.get_inputs()
-        input_nodes = frozenset([input_connections[input_key].other.node
-                                 for input_key in input_connections])
-        unfinished_dependencies = [dep_node for dep_node in input_nodes
-                                   if state[dep_node] is None]
-        if unfinished_dependencies:
-            node_queue.append(node)
-            node_queue += unfinished_dependencies
-            continue
-        input_args = {
-            input_key: state[other][other_key] for input_key,
-            other,
-            other_key in map(
-                lambda k: (
-                    k,
-                    input_connections[k].other.node,
-                    input_connections[k].other.key),
-                input_connections) if other_key in state[other]}
-        output_args = node.get_stage().run(node.get_outputs().keys(),
-                                           **input_args)
-        map(lambda k: output_args[k].write_to_read_phase(), output_args)
-        stage_printer.stage_print(node, input_args, output_args)
-        state[node] = output_args
-        if single_step:
-            import pdb
-            pdb.set_trace()
-    stage_printer.footer_print()
+    try:
+        while node_queue:
+            node = node_queue.pop()
+            if state[node] is not None:  # already computed
+                continue
+            input_connections = node.get_inputs()
+            input_nodes = frozenset([input_connections[input_key].other.node
+                                     for input_key in input_connections])
+            unfinished_dependencies = [dep_node for dep_node in input_nodes
+                                       if state[dep_node] is None]
+            if unfinished_dependencies:
+                node_queue.append(node)
+                node_queue += unfinished_dependencies
+                continue
+            input_args = {
+                input_key: state[other][other_key] for input_key,
+                other,
+                other_key in map(
+                    lambda k: (
+                        k,
+                        input_connections[k].other.node,
+                        input_connections[k].other.key),
+                    input_connections) if other_key in state[other]}
+            output_args = node.get_stage().run(node.get_outputs().keys(),
+                                               **input_args)
+            map(lambda k: output_args[k].write_to_read_phase(), output_args)
+            stage_printer.stage_print(node, input_args, output_args)
+            state[node] = output_args
+            if single_step:
+                import pdb
+                pdb.set_trace()
+        stage_printer.footer_print()
+    finally:
+        # UObjects don't clean up after themselves
+        for output_args in state.itervalues():
+            if output_args is not None:
+                [output_args[k].cleanup() for k in output_args]
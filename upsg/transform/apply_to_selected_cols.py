@@ -1,14 +1,13 @@
-import numpy as np
-
-from numpy.lib.recfunctions import merge_arrays
+from collections import OrderedDict
 
 from ..stage import RunnableStage, MetaStage
 from ..uobject import UObject, UObjectPhase
-from ..utils import np_sa_to_nd
+from ..utils import hstack_soas
 from ..pipeline import Pipeline
 from .identity import Identity
 from .split import SplitColumns
 from .hstack import HStack
+from .jit import ApplyKernel
 
 
 class ApplyToSelectedCols(MetaStage):
@@ -30,38 +29,165 @@ class ApplyToSelectedCols(MetaStage):
     kwargs : dict
         init kwargs for the stage
 
+    If an instance of the transform Stage has a callable 'kernel' attribute
+    and takes 'input' and produces 'output', the kernel is applied instead 
+    of running the Stage (see upsg.transform.jit.ApplyKernel). The kernel 
+    should take a 2-dimensional float64 array of the selected columns and 
+    return an array of the transformed columns. It will be compiled with 
+    numba if numba is installed.
+
+    If the transform Stage is a RunnableStage, splitting, transforming and 
+    stacking happen in a single Stage so that the columns which are not 
+    selected go straight into the output table rather than through a 
+    UObject of their own.
+
     """
 
+    class __Fused(RunnableStage):
+        """Splits off the selected columns, runs a RunnableStage on them and
+        stacks its output with the remaining columns, all in one Stage.
+
+        Equivalent to the SplitColumns -> stage -> HStack subgraph, but the 
+        columns that aren't selected are copied straight from the input 
+        table into the output table, instead of going through their own 
+        UObject.
+
+        """
+
+        def __init__(self, col_names, stage, in_key, out_keys):
+            self.__col_names = list(col_names)
+            self.__stage = stage
+            self.__in_key = in_key
+            self.__out_keys = out_keys
+
+        def __repr__(self):
+            return 'ApplyToSelectedCols({}, {})'.format(
+                self.__col_names, 
+                self.__stage)
+
+        @property
+        def input_keys(self):
+            return self.__stage.input_keys
+
+        @property
+        def output_keys(self):
+            return self.__stage.output_keys
+
+        def __stack(self, uo_trans, complement, n_rows):
+            uo_trans.write_to_read_phase()
+            uo_out = UObject(UObjectPhase.Write)
+            # Columns are copied into the output table, so views will do
+            uo_out.from_np(hstack_soas(
+                [uo_trans.to_soa(copy=False), complement], 
+                n_rows))
+            return uo_out
+
+        def run(self, outputs_requested, **kwargs):
+            in_key = self.__in_key
+            if in_key is None or in_key not in kwargs:
+                return self.__stage.run(outputs_requested, **kwargs)
+            col_names = self.__col_names
+            selected = set(col_names)
+            # Columns are copied into uo_selected or the output table, so
+            # views will do
+            in_cols = kwargs[in_key].to_soa(copy=False)
+            uo_selected = UObject(UObjectPhase.Write)
+            uo_selected.from_soa(OrderedDict(
+                (col, in_cols[col]) for col in col_names))
+            uo_selected.write_to_read_phase()
+            complement = OrderedDict(
+                (col, in_cols[col]) for col in in_cols if 
+                col not in selected)
+            stage_kwargs = dict(kwargs)
+            stage_kwargs[in_key] = uo_selected
+            outputs = self.__stage.run(outputs_requested, **stage_kwargs)
+            intermediates = [uo_selected]
+            for out_key in self.__out_keys:
+                if out_key in outputs:
+                    uo_trans = outputs[out_key]
+                    outputs[out_key] = self.__stack(uo_trans, complement,
+                                                    in_cols.n_rows)
+                    intermediates.append(uo_trans)
+            # The Stage may have passed some UObjects through. We only clean
+            # up the ones that no other Stage will see
+            passed_on = outputs.values() + kwargs.values()
+            for uo in intermediates:
+                if not any(uo is other for other in passed_on):
+                    uo.cleanup()
+            return outputs
+
     def __init__(self, col_names, stage_cls, *args, **kwargs):
         p = Pipeline()
+        stage = stage_cls(*args, **kwargs)
+        kernel = getattr(stage, 'kernel', None)
+        if (callable(kernel) and list(stage.input_keys) == ['input'] and
+                list(stage.output_keys) == ['output']):
+            stage = ApplyKernel(kernel)
+        if isinstance(stage, RunnableStage):
+            self.__init_fused(p, col_names, stage)
+        else:
+            self.__init_subgraph(p, col_names, stage)
         self.__pipeline = p
-        trans_node = p.add(stage_cls(*args, **kwargs))
+
+    @staticmethod
+    def __table_keys(stage):
+        """Finds the keys of stage that take the selected columns and the
+        keys that produce the transformed columns
+
+        Returns
+        -------
+        tuple (in_key, out_keys)
+            where in_key is a str or None and out_keys is a list of str
+
+        """
+        # TODO we assume that our Stage has one of these keys, which is bad
+        in_key = None
+        for key in ('input', 'X_train'):
+            if key in stage.input_keys:
+                in_key = key
+                break
+        out_keys = [key for key in ('output', 'X_new') if 
+                    key in stage.output_keys]
+        return (in_key, out_keys)
+
+    def __init_fused(self, p, col_names, stage):
+        in_key, out_keys = self.__table_keys(stage)
+        fused_node = p.add(self.__Fused(col_names, stage, in_key, out_keys))
+        in_node = p.add(Identity(list(fused_node.input_keys)))
+        correspondence = in_node.get_stage().get_correspondence()
+        for in_key in fused_node.input_keys:
+            in_node[correspondence[in_key]] > fused_node[in_key]
+        out_node = p.add(Identity(output_keys=list(fused_node.output_keys)))
+        correspondence = out_node.get_stage().get_correspondence(False)
+        for out_key in fused_node.output_keys:
+            fused_node[out_key] > out_node[correspondence[out_key]]
+        self.__in_node = in_node
+        self.__out_node = out_node
+
+    def __init_subgraph(self, p, col_names, stage):
+        trans_node = p.add(stage)
         trans_node_in_keys = list(trans_node.input_keys)
         in_node = p.add(Identity(trans_node_in_keys))
         correspondence = in_node.get_stage().get_correspondence()
         split_node = p.add(SplitColumns(col_names))
-        # TODO we assume that our Stage has one of these keys, which is bad
-        for in_key in ('input', 'X_train'):
-            if in_key in trans_node_in_keys:
-                in_node[correspondence[in_key]] > split_node['input']
-                split_node['output'] > trans_node[in_key]
-                trans_node_in_keys.remove(in_key)
-                break
+        in_key, out_keys = self.__table_keys(stage)
+        if in_key is not None:
+            in_node[correspondence[in_key]] > split_node['input']
+            split_node['output'] > trans_node[in_key]
+            trans_node_in_keys.remove(in_key)
         for in_key in trans_node_in_keys:
             in_node[correspondence[in_key]] > trans_node[in_key]
         trans_node_out_keys = list(trans_node.output_keys)
         merge_node = p.add(HStack(2))
         out_node = p.add(Identity(output_keys=trans_node_out_keys))
         correspondence = out_node.get_stage().get_correspondence(False)
-        for out_key in ('output', 'X_new'):
-            if out_key in trans_node_out_keys:
-                trans_node[out_key] > merge_node['input0']
-                split_node['complement'] > merge_node['input1']
-                merge_node['output'] > out_node[correspondence[out_key]]
-                trans_node_out_keys.remove(out_key)
+        for out_key in out_keys:
+            trans_node[out_key] > merge_node['input0']
+            split_node['complement'] > merge_node['input1']
+            merge_node['output'] > out_node[correspondence[out_key]]
+            trans_node_out_keys.remove(out_key)
         for out_key in trans_node_out_keys:
             trans_node[out_key] > out_node[correspondence[out_key]]
-        self.__pipeline = p
         self.__in_node = in_node
         self.__out_node = out_node
 
@@ -1,7 +1,5 @@
 import numpy as np
 
-from numpy.lib.recfunctions import merge_arrays
-
 from ..stage import RunnableStage, MetaStage
 from ..uobject import UObject, UObjectPhase
 from ..utils import np_sa_to_nd
@@ -1,7 +1,11 @@
-from numpy.lib.recfunctions import merge_arrays
+from collections import OrderedDict
+
+import numpy as np
 
 from ..uobject import UObject, UObjectPhase
 from ..stage import RunnableStage
+from ..utils import (np_dtype_is_homogeneous, np_sa_to_nd, np_nd_to_sa,
+                     hstack_soas)
 
 
 class HStack(RunnableStage):
@@ -36,9 +40,35 @@ class HStack(RunnableStage):
         return ['output']
 
     def run(self, outputs_requested, **kwargs):
+        # We need every column of every input, so there's nothing to gain
+        # from reading columns lazily
         arrays = [kwargs[input_key].to_np() for input_key in 
                   self.__input_keys]
-        # http://stackoverflow.com/questions/15815854/how-to-add-column-to-numpy-array
         out = UObject(UObjectPhase.Write)
-        out.from_np(merge_arrays(arrays, flatten=True))
+        n_rows = len(arrays[0])
+        # Inputs without columns contribute nothing to the output
+        with_cols = [A for A in arrays if len(A.dtype) > 0]
+        col_names = [name for A in with_cols for name in A.dtype.names]
+        if (n_rows > 0 and with_cols and 
+            len(set(col_names)) == len(col_names) and
+            all(len(A) == n_rows and np_dtype_is_homogeneous(A) and 
+                A.dtype[0] == with_cols[0].dtype[0] for A in with_cols)):
+            # If every column has the same type, we can stack 2-dimensional 
+            # views of the inputs, which copies contiguous blocks rather than
+            # one strided column at a time
+            first_dtype = with_cols[0].dtype[0]
+            stacked = np.hstack([np_sa_to_nd(A)[0].reshape(n_rows, 
+                                                           len(A.dtype)) 
+                                 for A in with_cols])
+            out_dtype = np.dtype([(name, first_dtype) for name in col_names])
+            out.from_np(np_nd_to_sa(stacked, out_dtype))
+            return {'output': out}
+        if not col_names:
+            # from_np doesn't take tables without columns
+            out.from_soa({}, n_rows)
+            return {'output': out}
+        out.from_np(hstack_soas(
+            [OrderedDict((name, A[name]) for name in A.dtype.names) for 
+             A in arrays],
+            n_rows))
         return {'output': out}
@@ -0,0 +1,102 @@
+import inspect
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from ..stage import RunnableStage
+from ..uobject import UObject, UObjectPhase
+from ..utils import np_sa_to_nd, np_nd_to_sa
+
+# Compiling for an explicit signature happens once, when the kernel is
+# wrapped, rather than lazily every time numba sees a new argument type
+KERNEL_SIGNATURE = 'float64[:,:](float64[:,:])'
+
+
+def jit_kernel(kernel, signature=KERNEL_SIGNATURE):
+    """Compiles a column kernel with numba.njit
+
+    If numba is not installed, the kernel is returned unaltered.
+
+    Parameters
+    ----------
+    kernel : 2-dimensional numpy.ndarray -> 2-dimensional numpy.ndarray
+        function to compile. It must be a plain function or a staticmethod, 
+        since numba can't compile bound methods
+    signature : str
+        numba signature to compile the kernel for
+
+    Returns
+    -------
+    2-dimensional numpy.ndarray -> 2-dimensional numpy.ndarray
+        The compiled kernel
+
+    """
+    if not callable(kernel):
+        raise TypeError('Kernel {} is not callable'.format(kernel))
+    if inspect.ismethod(kernel):
+        # Fail the same way whether or not numba is installed
+        raise TypeError('Kernel {} must be a plain function or a '
+                        'staticmethod'.format(kernel))
+    if numba is None:
+        return kernel
+    try:
+        return numba.njit(signature, cache=True)(kernel)
+    except RuntimeError:
+        # numba can only cache kernels whose source file it can find, which
+        # rules out e.g. kernels defined with exec or in modules imported by
+        # a relative path from a different working directory
+        return numba.njit(signature)(kernel)
+
+
+class ApplyKernel(RunnableStage):
+    """Applies a numeric kernel to every column of a table
+
+    The table is converted to a 2-dimensional float64 array, which is passed
+    to the kernel. The kernel is compiled with numba if numba is installed.
+
+    **Input Keys**
+
+    input
+
+    **Output Keys**
+
+    output
+        table returned by the kernel. If the kernel returns as many columns
+        as it was given, the columns keep their names
+
+    Parameters
+    ----------
+    kernel : 2-dimensional numpy.ndarray -> 2-dimensional numpy.ndarray
+        function to apply. It must take and return arrays of float64, and
+        it must be a plain function or a staticmethod
+
+    """
+
+    def __init__(self, kernel):
+        self.__kernel = jit_kernel(kernel)
+
+    @property
+    def input_keys(self):
+        return ['input']
+
+    @property
+    def output_keys(self):
+        return ['output']
+
+    def run(self, outputs_requested, **kwargs):
+        in_array = kwargs['input'].to_np()
+        nd = np_sa_to_nd(in_array)[0].reshape(len(in_array), 
+                                             len(in_array.dtype))
+        result = np.ascontiguousarray(
+            self.__kernel(np.ascontiguousarray(nd, dtype=np.float64)))
+        dtype = None
+        if result.shape[1] == len(in_array.dtype):
+            dtype = np.dtype([(name, result.dtype) for name in
+                              in_array.dtype.names])
+        uo_out = UObject(UObjectPhase.Write)
+        uo_out.from_np(np_nd_to_sa(result, dtype))
+        return {'output': uo_out}
@@ -2,6 +2,7 @@ import tokenize
 from StringIO import StringIO
 from token import *
 import itertools as it
+from collections import OrderedDict
 import numpy as np
 import ast
 
@@ -51,20 +52,23 @@ class SplitColumns(RunnableStage):
     def run(self, outputs_requested, **kwargs):
         # TODO different implementation if internally sql?
         columns = list(self.__columns)
+        selected = set(columns)
 
         to_return = {}
-        in_array = kwargs['input'].to_np()
+        # Columns are copied into the output tables, so views will do
+        in_cols = kwargs['input'].to_soa(copy=False)
 
         if 'output' in outputs_requested:
             uo_out = UObject(UObjectPhase.Write)
-            uo_out.from_np(in_array[columns])
+            uo_out.from_soa(OrderedDict(
+                (col, in_cols[col]) for col in columns), in_cols.n_rows)
             to_return['output'] = uo_out
 
         if 'complement' in outputs_requested:
             uo_complement = UObject(UObjectPhase.Write)
-            # http://stackoverflow.com/questions/3462143/get-difference-between-two-lists
-            remaining_columns = list(set(in_array.dtype.names) - set(columns))
-            uo_complement.from_np(in_array[remaining_columns])
+            uo_complement.from_soa(OrderedDict(
+                (col, in_cols[col]) for col in in_cols if 
+                col not in selected), in_cols.n_rows)
             to_return['complement'] = uo_complement
 
         return to_return
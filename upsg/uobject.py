@@ -1,11 +1,21 @@
 import tables
 import uuid
-from collections import namedtuple
+from collections import namedtuple, Mapping
 import numpy as np
 import sqlalchemy
 from utils import np_nd_to_sa, is_sa, np_type, np_sa_to_dict, dict_to_np_sa
+from utils import csv_to_np_sa, soa_to_np_sa
 from utils import sql_to_np, np_to_sql, random_table_name, obj_to_str
 
+# Compression used for tables stored in .upsg files. Blosc at a low level
+# compresses faster than the files can be written, so smaller files win
+TABLE_FILTERS = tables.Filters(complib='blosc', complevel=1, shuffle=True)
+
+# numpy.dtype.kind of the column types that can be stored in .upsg files 
+# (datetime64 columns are stored as int64)
+STORABLE_KINDS = 'biufcSM'
+
+
 SQLTableInfo_ = namedtuple(
     'SQLTableInfo', [
         'table', 'conn', 'db_url', 'conn_params'])
@@ -37,6 +47,50 @@ class UObjectException(Exception):
     pass
 
 
+class LazyTable(Mapping):
+
+    """A read-only mapping of column name to column which only reads a 
+    column when it is asked for.
+
+    Parameters
+    ----------
+    col_names : list of str
+        Names of the columns in the table, in order
+    read_col : str -> numpy.ndarray
+        Function which takes the name of a column and returns a 1-dimensional
+        array of the values in that column
+    n_rows : int
+        Number of rows in the table
+
+    """
+
+    def __init__(self, col_names, read_col, n_rows):
+        self.__col_names = list(col_names)
+        self.__col_name_set = frozenset(col_names)
+        self.__read_col = read_col
+        self.__n_rows = n_rows
+
+    @property
+    def n_rows(self):
+        """Number of rows in the table, found without reading any columns"""
+        return self.__n_rows
+
+    def __getitem__(self, col_name):
+        if col_name not in self.__col_name_set:
+            raise KeyError(col_name)
+        return self.__read_col(col_name)
+
+    def __contains__(self, col_name):
+        # Mapping's default would read the column
+        return col_name in self.__col_name_set
+
+    def __iter__(self):
+        return iter(self.__col_names)
+
+    def __len__(self):
+        return len(self.__col_names)
+
+
 class UObjectPhase(object):
 
     """Enumeration of UObject phases
@@ -61,6 +115,11 @@ class UObject(object):
     .upsg file that resides on the local disk. This .upsg file will be used
     to communicate between different steps in the pipeline.
 
+    Tables written with from_np are kept in memory as numpy arrays and are
+    only written into the .upsg file when it is actually needed (i.e. when
+    get_image is called). Stages that run in the same process can then pass
+    tables to each other without going through HDF5.
+
     The interface to use will be chosen once when the UObject is being
     written and at least once when the UObject is being read. In order to
     choose an interface, first create a UObject instance, and then invoke one
@@ -92,6 +151,11 @@ class UObject(object):
 
     """
 
+    # UObjects are created for every edge of a pipeline, so we skip the 
+    # per-instance __dict__
+    __slots__ = ('__phase', '__finalized', '__file', '__array', 
+                 '__storage_method', '__np_table')
+
     def __open_for_read(self, hdf5_image):
         file_name = str(uuid.uuid4()) + '.upsg'
         #print 'Reading ' + file_name
@@ -101,11 +165,28 @@ class UObject(object):
                 driver='H5FD_CORE',
                 driver_core_backing_store=0,
                 driver_core_image=hdf5_image)
+        # Every to_ method needs these, so we only look them up once
+        self.__storage_method = self.__file.get_node_attr(
+            '/upsg_inf',
+            'storage_method')
+        self.__np_table = None
+        if self.__storage_method == 'np':
+            self.__np_table = self.__find_np_table()
+
+    def __find_np_table(self):
+        """Returns the np table, or None if the table has no columns"""
+        np_group = self.__file.root.np
+        if 'table' in np_group:
+            return np_group.table
+        return None
 
     def __init__(self, phase, hdf5_image=None):
 
         self.__phase = phase
         self.__finalized = False
+        self.__array = None
+        self.__storage_method = 'INCOMPLETE'
+        self.__np_table = None
 
         if phase == UObjectPhase.Write:
             # create an in-memory hdf5 file
@@ -120,8 +201,7 @@ class UObject(object):
             self.__file.set_node_attr(
                 upsg_inf_grp,
                 'storage_method',
-                'INCOMPLETE')
-            self.__file.flush()
+                self.__storage_method)
             return
 
         if phase == UObjectPhase.Read:
@@ -133,10 +213,20 @@ class UObject(object):
 
         raise UObjectException('Invalid phase provided')
 
-    def __del__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
         self.cleanup()
 
     def cleanup(self):
+        """Releases the resources used by this UObject.
+
+        Pipeline runners should call this once a UObject is no longer 
+        needed. Alternatively, UObjects can be used as context managers.
+        
+        """
+        self.__array = None
         try:
             self.__file.close()
         except IOError:
@@ -144,8 +234,18 @@ class UObject(object):
             pass
 
     def get_image(self):
+        self.__materialize()
         return self.__file.get_file_image()
 
+    def __materialize(self):
+        """Writes a table that is being held in memory to the .upsg file"""
+        if self.__storage_method != 'memory':
+            return
+        hfile = self.__file
+        self.__write_np(hfile, self.__array)
+        self.__storage_method = 'np'
+        hfile.set_node_attr('/upsg_inf', 'storage_method', 'np')
+
     def get_phase(self):
         """
         
@@ -183,9 +283,10 @@ class UObject(object):
         if not self.__finalized:
             raise UObjectException('UObject is not finalized')
 
-        image = self.__file.get_file_image()
-        self.__file.close()
-        self.__open_for_read(image)
+        # The file we wrote is still open and can be read from, so rather 
+        # than reopening it from its image we keep using it
+        if self.__storage_method == 'np':
+            self.__np_table = self.__find_np_table()
         self.__phase = UObjectPhase.Read
         self.__finalized = False
 
@@ -201,22 +302,29 @@ class UObject(object):
     def __convert_to(self, target_format, conn=None, db_url=None,
                      conn_params={}, tbl_name=None):
         # TODO write this nicer than if statements
-        storage_method = self.__file.get_node_attr(
-            '/upsg_inf',
-            'storage_method')
+        storage_method = self.__storage_method
         hfile = self.__file
-        if storage_method == 'np':
-            A = hfile.root.np.table.read()
-
-            # cast back to np.datetime64 as necessary
-            try:
-                dt_cols = hfile.get_node(hfile.root.np, 'dt_cols').read()
-                view_dtype = A.dtype.descr
-                for col, dt_dtype in dt_cols:
-                    view_dtype[col] = (view_dtype[col][0], dt_dtype)
-                A = A.view(dtype=view_dtype)
-            except tables.NoSuchNodeError:
-                pass
+        if storage_method in ('np', 'memory'):
+            if self.__array is not None:
+                # Stages are free to modify the arrays they get (e.g. FillNA
+                # does), so each reader gets its own copy
+                A = self.__array.copy()
+            elif self.__np_table is None:
+                A = np.empty(
+                    hfile.get_node_attr(hfile.root.np, 'n_rows'), 
+                    dtype=[])
+            else:
+                A = self.__np_table.read()
+
+                # cast back to np.datetime64 as necessary
+                try:
+                    dt_cols = hfile.get_node(hfile.root.np, 'dt_cols').read()
+                    view_dtype = A.dtype.descr
+                    for col, dt_dtype in dt_cols:
+                        view_dtype[col] = (view_dtype[col][0], dt_dtype)
+                    A = A.view(dtype=view_dtype)
+                except tables.NoSuchNodeError:
+                    pass
 
             if target_format == 'np':
                 return A
@@ -260,6 +368,31 @@ class UObject(object):
             raise UObjectException('Unsupported conversion')
         raise UObjectException('Unsupported internal format')
 
+    def __np_lazy_table(self):
+        """Returns a LazyTable reading columns from the np table in HDF5"""
+        hfile = self.__file
+        table = self.__np_table
+        if table is None:
+            return LazyTable([], None, 
+                             hfile.get_node_attr(hfile.root.np, 'n_rows'))
+        col_names = table.colnames
+        # cast back to np.datetime64 as necessary
+        dt_dtypes = {}
+        try:
+            dt_cols = hfile.get_node(hfile.root.np, 'dt_cols').read()
+            dt_dtypes = {col_names[col]: dt_dtype for col, dt_dtype in 
+                         dt_cols}
+        except tables.NoSuchNodeError:
+            pass
+
+        def read_col(name):
+            col = table.read(field=name)
+            if name in dt_dtypes:
+                col = col.view(dtype=dt_dtypes[name])
+            return col
+
+        return LazyTable(col_names, read_col, table.nrows)
+
     def __to(self, converter):
         """Does generic book-keeping when a "to_" function is invoked.
 
@@ -297,6 +430,44 @@ class UObject(object):
 
         return self.__to(lambda: self.__convert_to('np'))
 
+    def to_soa(self, copy=True):
+        """Makes the universal object available as a dictionary of columns.
+
+        Columns are only read when they are looked up, so consumers that
+        need only some of the columns don't pay for reading the rest. 
+        Columns should be looked up before the UObject is cleaned up.
+
+        Parameters
+        ----------
+        copy : bool
+            If False, columns of a table held in memory are views of that
+            table rather than copies. Pass False only if the columns will not
+            be modified, e.g. if they are about to be copied into another
+            table
+
+        Returns
+        -------
+        LazyTable
+            Maps each column name to a 1-dimensional array of that column's
+            values, iterating in the order that the columns appear in the 
+            table. 
+
+        """
+
+        def converter():
+            if self.__array is not None:
+                A = self.__array
+                if copy:
+                    return LazyTable(A.dtype.names, 
+                                     lambda name: A[name].copy(), len(A))
+                return LazyTable(A.dtype.names, lambda name: A[name], len(A))
+            if self.__storage_method == 'np':
+                return self.__np_lazy_table()
+            A = self.__convert_to('np')
+            return LazyTable(A.dtype.names, lambda name: A[name], len(A))
+
+        return self.__to(converter)
+
     def to_dataframe(self):
         from pandas import DataFrame
         return DataFrame(self.to_np())
@@ -314,13 +485,17 @@ class UObject(object):
             If not provided, will use by default delimiter=',', fmt='%s'. 
             In any case, UPSG will automatically add a header
 
+            If kwargs are not provided, the csv will be written with pandas
+            when possible, which is much faster than numpy.savetxt
+
         Returns
         -------
         str
             The path of the csv file
 
         """
-        if not kwargs:
+        use_defaults = not kwargs
+        if use_defaults:
             kwargs = {'delimiter': ',', 'fmt':'%s'}
 
         def converter():
@@ -328,12 +503,49 @@ class UObject(object):
             header = ",".join(map(
                 lambda field_name: '"{}"'.format(field_name),
                 table.dtype.names))
+            # pandas formats datetimes differently than numpy does, it
+            # quotes strings that numpy would write as they are, and it can't
+            # write columns that hold arrays
+            n_cols = len(table.dtype)
+            if use_defaults and not any(
+                    table.dtype[name].kind == 'M' or 
+                    table.dtype[name].shape != () or
+                    (table.dtype[name].kind == 'S' and 
+                     self.__needs_quotes(table[name], n_cols)) for 
+                    name in table.dtype.names):
+                try:
+                    import pandas as pd
+                except ImportError:
+                    pd = None
+                if pd is not None:
+                    # Same layout as np.savetxt: commented header, 'nan' for 
+                    # missing floats
+                    with open(file_name, 'w') as fout:
+                        fout.write('# {}\n'.format(header))
+                        pd.DataFrame.from_records(table).to_csv(
+                            fout, 
+                            header=False, 
+                            index=False, 
+                            na_rep='nan')
+                    return file_name
             kwargs['header'] = header
             np.savetxt(file_name, table, **kwargs)
             return file_name
 
         return self.__to(converter)
 
+    @staticmethod
+    def __needs_quotes(col, n_cols):
+        """True iff the csv module would quote some entry of a string column
+        in a table with n_cols columns"""
+        if len(col) == 0:
+            return False
+        if n_cols == 1 and (col == '').any():
+            # a row consisting of one empty field is written as ""
+            return True
+        return any(np.char.find(col, special).max() >= 0 for 
+                   special in (',', '"', '\n', '\r'))
+
     def to_sql(self, db_url, conn_params, tbl_name=None):
         """Makes the universal object available in SQL.
 
@@ -407,12 +619,13 @@ class UObject(object):
             raise UObjectException('UObject is already finalized')
 
         storage_method = converter(self.__file)
+        self.__storage_method = storage_method
 
         self.__file.set_node_attr(
             '/upsg_inf',
             'storage_method',
             storage_method)
-        self.__file.flush()
+        # File.get_file_image and File.close both flush, so we don't have to
         # The pipeline is responsible for syncing the persistent_file
         #self.__file.close()
         self.__finalized = True
@@ -429,17 +642,24 @@ class UObject(object):
             keyword arguments to pass to numpy.genfromtxt
             (http://docs.scipy.org/doc/numpy/reference/generated/numpy.genfromtxt.html)
             If no kwargs are provided, we use: dtype=None, delimiter=',', 
-            names=True.
+            names=True. In that case, the csv will be read with pandas 
+            when possible, which is much faster than genfromtxt.
 
         """
-        if not kwargs:
+        use_defaults = not kwargs
+        if use_defaults:
             kwargs = {'dtype': None, 'delimiter': ',', 'names': True}
 
         def converter(hfile):
-            data = np.genfromtxt(filename, **kwargs)
+            data = None
+            if use_defaults:
+                data = csv_to_np_sa(filename)
+            if data is None:
+                data = np.genfromtxt(filename, **kwargs)
 
             np_group = hfile.create_group('/', 'np')
-            hfile.create_table(np_group, 'table', obj=data)
+            hfile.create_table(np_group, 'table', obj=data,
+                               filters=TABLE_FILTERS)
             return 'np'
 
         self.__from(converter)
@@ -448,9 +668,15 @@ class UObject(object):
         """Writes the contents of a numpy array to a UObject and prepares the
         .upsg file.
 
+        The array is held in memory rather than copied, so it should not be
+        modified after it has been passed to the UObject.
+
         Parameters
         ----------
         A: numpy.array
+            Must have at least one column, and every column must have a type
+            that PyTables can store (see STORABLE_KINDS). Use from_soa to 
+            write a table without columns
 
         """
 
@@ -459,24 +685,80 @@ class UObject(object):
                 to_write = A
             else:
                 to_write = np_nd_to_sa(A)
-            np_group = hfile.create_group('/', 'np')
+            # The array isn't written to HDF5 until something asks for its 
+            # image, so check now that it can be written rather than failing 
+            # later in some other stage
+            if len(to_write.dtype) == 0:
+                raise UObjectException(
+                    'Cannot write an array without columns with from_np')
+            for name in to_write.dtype.names:
+                if to_write.dtype[name].base.kind not in STORABLE_KINDS:
+                    raise UObjectException(
+                        ('Column {} has type {}, which cannot be stored in '
+                         'a UObject').format(name, to_write.dtype[name]))
+            # Selecting multiple fields of a structured array can give us a
+            # view with padding between the fields. Readers expect a packed
+            # table, like the one we'd get back from HDF5
+            packed_dtype = np.dtype([(name, to_write.dtype[name]) for name in
+                                     to_write.dtype.names])
+            if to_write.dtype != packed_dtype:
+                to_write = to_write.astype(packed_dtype)
+            self.__array = to_write
+            return 'memory'
 
-            # case datetime64 columns to int64 and note it in metadata
-            to_write_dtype = to_write.dtype
-            dt_cols = [(i, col_dtype[1]) for i, col_dtype in 
-                       enumerate(to_write_dtype.descr)
-                       if 'M8' in col_dtype[1]]
-            if dt_cols:
-                view_dtype = [(name, '<i8') if 'M8' in fmt else (name, fmt) 
-                              for name, fmt in to_write_dtype.descr]
-                to_write = to_write.view(dtype=view_dtype)
-                dt_cols_sa = np.array(
-                        dt_cols, 
-                        dtype=[('col_num', int), ('dtype', '|S7')])
-                hfile.create_table(np_group, 'dt_cols', dt_cols_sa)
-
-            hfile.create_table(np_group, 'table', obj=to_write)
-            return 'np'
+        self.__from(converter)
+
+    def __write_np(self, hfile, to_write):
+        """Writes a structured array into the np group of hfile"""
+        np_group = hfile.create_group('/', 'np')
+
+        if len(to_write.dtype) == 0:
+            # HDF5 can't store a table without columns, so we only note how
+            # many rows it has
+            hfile.set_node_attr(np_group, 'n_rows', len(to_write))
+            return
+
+        # case datetime64 columns to int64 and note it in metadata
+        to_write_dtype = to_write.dtype
+        dt_cols = [(i, col_dtype[1]) for i, col_dtype in 
+                   enumerate(to_write_dtype.descr)
+                   if 'M8' in col_dtype[1]]
+        if dt_cols:
+            view_dtype = [(name, '<i8') if 'M8' in fmt else (name, fmt) 
+                          for name, fmt in to_write_dtype.descr]
+            to_write = to_write.view(dtype=view_dtype)
+            dt_cols_sa = np.array(
+                    dt_cols, 
+                    dtype=[('col_num', int), ('dtype', '|S7')])
+            hfile.create_table(np_group, 'dt_cols', dt_cols_sa)
+
+        hfile.create_table(np_group, 'table', obj=to_write,
+                           filters=TABLE_FILTERS)
+
+    def from_soa(self, soa, n_rows=None):
+        """Writes the contents of a dictionary of columns to a UObject and
+        prepares the .upsg file.
+
+        Parameters
+        ----------
+        soa : dict of (str : numpy.ndarray)
+            Maps column names to 1-dimensional arrays of equal length, as 
+            returned by to_soa. Use a collections.OrderedDict to control the
+            order of the columns.
+        n_rows : int or None
+            Number of rows in the table. Only needed if soa has no columns
+
+        """
+        sa = soa_to_np_sa(soa, n_rows)
+        if len(sa.dtype) > 0:
+            self.from_np(sa)
+            return
+
+        # A table without columns (e.g. what is left after selecting every
+        # column) is only stored as its number of rows
+        def converter(hfile):
+            self.__array = sa
+            return 'memory'
 
         self.__from(converter)
 
@@ -540,7 +822,8 @@ class UObject(object):
 
         def converter(hfile):
             np_group = hfile.create_group('/', 'np')
-            hfile.create_table(np_group, 'table', obj=dict_to_np_sa(d))
+            hfile.create_table(np_group, 'table', obj=dict_to_np_sa(d),
+                               filters=TABLE_FILTERS)
             return 'np'
 
         self.__from(converter)
@@ -1,11 +1,16 @@
 import os 
 import inspect
+import csv
 import itertools as it
 import re
 import uuid
 import upsg
 import cgi
 import importlib
+import warnings
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 import numpy as np
 from numpy.lib.recfunctions import merge_arrays
@@ -74,7 +79,8 @@ def np_sa_to_nd(sa):
             return (sa.view(dtype=dtype[0]).reshape(()), dtype)
         return (sa.view(dtype=dtype[0]).reshape(len(sa)), dtype)
     if np_dtype_is_homogeneous(sa):
-        return (sa.view(dtype=dtype[0]).reshape(len(sa), -1), dtype)
+        # -1 can't be inferred when there are no rows
+        return (sa.view(dtype=dtype[0]).reshape(len(sa), len(dtype)), dtype)
     # If type isn't homogeneous, we have to convert
     dtype_it = (dtype[i] for i in xrange(len(dtype)))
     most_permissive = max(dtype_it, key=__type_permissiveness)
@@ -178,6 +184,111 @@ def dict_to_np_sa(d):
     return np.array(vals, dtype=dtype)
 
 
+# Tables smaller than this many bytes are filled by a single thread, since
+# starting threads costs more than they save
+PARALLEL_FILL_MIN_BYTES = 2 ** 26
+
+def soa_to_np_sa(soa, n_rows=None):
+    """Converts a dictionary of columns to a Numpy structured array
+
+    Parameters
+    ----------
+    soa : dict of (str : numpy.ndarray)
+        Maps column names to 1-dimensional arrays of equal length. Columns
+        will appear in the order in which the dictionary iterates over them,
+        so pass a collections.OrderedDict if column order matters
+    n_rows : int or None
+        Number of rows in the table. Only needed if soa has no columns, in 
+        which case the number of rows can't be found from the columns
+
+    Returns
+    -------
+    A Numpy structured array
+
+    """
+    col_names = list(soa.keys())
+    # look up each column only once, in case looking it up is expensive
+    cols = [soa[col_name] for col_name in col_names]
+    if not cols:
+        if n_rows is None:
+            raise ValueError('Cannot convert a dictionary with no columns '
+                             'unless n_rows is given')
+        return np.empty(n_rows, dtype=[])
+    # Allocate the table once and fill it in place
+    # http://stackoverflow.com/questions/5355744/numpy-joining-structured-arrays
+    sa = np.empty(len(cols[0]), dtype=[(col_name, col.dtype) for 
+                                       col_name, col in zip(col_names, cols)])
+
+    def fill(bounds):
+        lo, hi = bounds
+        for col_name, col in zip(col_names, cols):
+            sa[col_name][lo:hi] = col[lo:hi]
+
+    n_threads = min(cpu_count(), len(sa))
+    if n_threads > 1 and sa.nbytes >= PARALLEL_FILL_MIN_BYTES:
+        # numpy releases the GIL while copying, so the table can be filled in
+        # parallel. Each thread gets its own block of rows rather than its 
+        # own columns so that threads don't write to the same cache lines
+        edges = np.linspace(0, len(sa), n_threads + 1).astype(int)
+        pool = ThreadPool(n_threads)
+        try:
+            pool.map(fill, zip(edges[:-1], edges[1:]))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fill((0, len(sa)))
+    return sa
+
+
+def hstack_soas(soas, n_rows=None):
+    """Stacks dictionaries of columns side by side into one Numpy structured
+    array
+
+    If the tables do not all have the same number of rows, warns and falls
+    back to numpy.lib.recfunctions.merge_arrays, which pads the shorter 
+    tables
+
+    Parameters
+    ----------
+    soas : list of dict of (str : numpy.ndarray)
+        Tables to stack, in the order their columns should appear. Each
+        column is looked up only once
+    n_rows : int or None
+        Number of rows in the tables. Only needed if none of them have 
+        columns
+
+    Returns
+    -------
+    A Numpy structured array
+
+    Raises
+    ------
+    ValueError
+        If a column name appears in more than one table
+
+    """
+    columns = OrderedDict()
+    tables = []
+    for soa in soas:
+        table = OrderedDict()
+        for col_name in soa:
+            if col_name in columns:
+                raise ValueError(
+                    'Column {} appears in more than one table'.format(
+                        col_name))
+            columns[col_name] = table[col_name] = soa[col_name]
+        if table:
+            tables.append(table)
+    if len(set(len(col) for col in columns.itervalues())) > 1:
+        warnings.warn('Tables have different numbers of rows. Falling back '
+                      'to numpy.lib.recfunctions.merge_arrays')
+        # http://stackoverflow.com/questions/15815854/how-to-add-column-to-numpy-array
+        return merge_arrays([soa_to_np_sa(table) for table in tables], 
+                            flatten=True, usemask=False)
+    return soa_to_np_sa(columns, n_rows)
+
+
 # http://stackoverflow.com/questions/20078816/replace-non-ascii-characters-with-a-single-space
 re_utf_to_ascii = re.compile(r'[^\x00-\x7F]+')
 
@@ -414,6 +525,90 @@ def obj_to_str(sa):
             continue
         cols.append(col)
         ndtype.append((col_name, sub_dtype))
-    return merge_arrays(cols).view(dtype=ndtype)
+    out = np.empty(len(sa), dtype=ndtype)
+    for (col_name, sub_dtype), col in zip(ndtype, cols):
+        out[col_name] = col
+    return out
+
+# Column names that numpy.genfromtxt would alter
+re_genfromtxt_safe_name = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+genfromtxt_excluded_names = ('return', 'file', 'print')
+
+def __genfromtxt_reads_as_number(col):
+    """True iff genfromtxt would read a column of strings as numbers"""
+    # genfromtxt tries int, float and complex, any of which complex accepts.
+    # For columns of words, this stops at the first value
+    try:
+        for val in col:
+            complex(val)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def csv_to_np_sa(filename):
+    """Reads a csv into a Numpy structured array using pandas' C parser
+
+    For csvs with a plain header and no missing values, the result is the
+    same as that of:
+
+        numpy.genfromtxt(filename, dtype=None, delimiter=',', names=True)
+
+    but it is produced much faster. If the csv is one that genfromtxt
+    would read differently (e.g. it has missing values, a commented
+    header, numbers too big for int64 or spaces at the ends of lines) or if 
+    pandas is not installed, returns None. The caller should then fall back
+    on genfromtxt.
 
+    Parameters
+    ----------
+    filename : str
+        The name of the csv file
+
+    Returns
+    -------
+    A Numpy structured array or None
 
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        return None
+    with open(filename) as fin:
+        header = fin.readline()
+    if header.startswith('#'):
+        return None
+    col_names = header.rstrip('\r\n').split(',')
+    if len(set(col_names)) != len(col_names):
+        return None
+    if not all(re_genfromtxt_safe_name.match(name) and 
+               name not in genfromtxt_excluded_names for name in col_names):
+        return None
+    # genfromtxt doesn't treat quotes specially, but it does strip comments.
+    # round_trip float parsing gives the same values as Python's float()
+    df = pd.read_csv(filename, quoting=csv.QUOTE_NONE, comment='#',
+                     float_precision='round_trip', low_memory=False)
+    if len(df) == 0 or df.isnull().values.any():
+        # genfromtxt fills missing values differently than pandas does
+        return None
+    cols = []
+    for col_ind, col_name in enumerate(df.columns):
+        col = df[col_name].values
+        if col.dtype.kind == 'O':
+            # pandas leaves numbers it can't parse (e.g. integers too big for
+            # int64) as strings
+            if __genfromtxt_reads_as_number(col):
+                return None
+            col = col.astype('S')
+            # genfromtxt strips spaces from the ends of each line
+            if ((col_ind == 0 and np.char.startswith(col, ' ').any()) or
+                (col_ind == len(df.columns) - 1 and 
+                 np.char.endswith(col, ' ').any())):
+                return None
+        if col.dtype.kind not in 'bifS':
+            return None
+        cols.append(col)
+    sa = np.empty(len(df), dtype=[(str(col_name), col.dtype) for 
+                                  col_name, col in zip(df.columns, cols)])
+    for col_name, col in zip(sa.dtype.names, cols):
+        sa[col_name] = col
+    return sa